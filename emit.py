@@ -1,33 +1,108 @@
 import tokens
 
+# Precomputed indentation strings, indexed by indent level.
+_INDENT = [" " * i for i in range(64)]
+
+# File-scope helper emitted once per generated rule that uses a commutative
+# opcode; calls the check functor with both argument orders.
+_TRY_COMMUTE_TEMPLATE = (
+    "template<class F>\n"
+    "static int4 try_commute(Varnode* a, Varnode* b, F&& f)\n"
+    "\n"
+    "{\n"
+    "  return f(a, b) || f(b, a);\n"
+    "}\n"
+)
+
+# The two walks the emitter performs over a rule's ASTs
+MATCH_CHECK = 0
+REPLACE_BUILD = 1
+
+class EmitContext:
+    """
+    The state threaded through a single AST walk of the emitter. In
+    MATCH_CHECK mode, 'target' is the C expression holding the varnode under
+    scrutiny; in REPLACE_BUILD mode it is the name of the parent PcodeOp
+    variable and 'input_num' the input slot being wired.
+    """
+    __slots__ = ("mode", "indent", "target", "input_num", "is_commutative")
+
+    def __init__(self, mode: int, target: str, indent: int = 2, input_num: int = 0, is_commutative: bool = False):
+        self.mode = mode
+        self.target = target
+        self.indent = indent
+        self.input_num = input_num
+        self.is_commutative = is_commutative
+
 class Emitter:
-    def __init__(self):
+    def __init__(self, declared_vars: frozenset[str] = frozenset()):
         # keep track of variables we come across
         self._variables = set()
-        self._declared_vars = set()
+
+        # the variables that are forward-declared at the top of applyOp, so
+        # _emit_create_varnode must assign instead of declare them
+        self._declared_vars = declared_vars
+
+        # next free suffix per temp-name prefix
+        self._prefix_counters: dict[str, int] = {}
+
+        # file-scope helpers shared by all emission sites in this rule
+        self._preamble: list[str] = []
+
+        # per-mode visitor tables keyed on the concrete token type, so each
+        # visit does a single dict lookup instead of an isinstance ladder
+        check_visitors = {
+            tokens.TOK_OPCODE: self._visit_check_opcode,
+            tokens.TOK_VAR: self._visit_check_var,
+            tokens.TOK_NUMBER: self._visit_check_constant,
+        }
+        build_visitors = {
+            tokens.TOK_OPCODE: self._visit_build_opcode,
+            tokens.TOK_VAR: self._visit_build_var,
+            tokens.TOK_NUMBER: self._visit_build_const,
+        }
+        for binop_class in tokens.TOK_BINARY_OPERATION.__subclasses__():
+            check_visitors[binop_class] = self._visit_check_constant
+            build_visitors[binop_class] = self._visit_build_const
+
+        self._visitors = {
+            MATCH_CHECK: check_visitors,
+            REPLACE_BUILD: build_visitors,
+        }
+
+    def visit(self, node: tokens.Token, ctx: EmitContext) -> str:
+        visitor = self._visitors[ctx.mode].get(type(node))
+        if visitor is None:
+            raise ValueError(f"Unsupported OPNAME argument type {type(node)}")
+
+        return visitor(node, ctx)
 
     def emit_apply_op(self, class_name: str, match_expr: tokens.TOK_OPCODE, constraints: list[tokens.TOK_CONSTRAINT], replace_expr: tokens.TOK_OPCODE | tokens.TOK_VAR) -> str:
-        out = (
+        parts: list[str] = [
             f"int4 RuleSimplify{class_name}::applyOp(PcodeOp *op, Funcdata &data)\n"
             "\n"
             "{\n"
             "\n"
             "  // Remaining checks on the match expression\n"
-        )
+        ]
 
         # First verify the other parts of the match expr
         assert isinstance(match_expr, tokens.TOK_OPCODE)
 
         # Declare all named variables in this scope because we might need them
-        # later
+        # later (in first-use order, deduplicated)
+        declared = set()
         for var in replace_expr.get_variables():
-            out += self._emit_declare_var(var)
+            var_name = var.to_c()
+            if var_name not in declared:
+                declared.add(var_name)
+                parts.append(self._emit_declare_var(var_name))
 
-        out += self._emit_check_opcode_children("op", match_expr, 2)
+        parts.append(self._emit_check_opcode_children("op", match_expr, 2))
 
         # Now the extra constraints
         if constraints:
-            out += (
+            parts.append(
                 "\n"
                 "  // Some more checks for the extra constraints\n"
             )
@@ -37,16 +112,16 @@ class Emitter:
 
         for constr in constraints:
             code, new_indent_level = constr.to_check_c(self, indent_level)
-            out += code
+            parts.append(code)
 
             if new_indent_level != indent_level:
                 finish_constraints.append((indent_level, constr))
                 indent_level = new_indent_level
 
         for indent_level, constr in reversed(finish_constraints):
-            out += constr.to_check_c_end(self, indent_level)
+            parts.append(constr.to_check_c_end(self, indent_level))
 
-        out += (
+        parts.append(
             "\n"
             "  // matched this PcodeOp - replace this with the simplified structure\n"
         )
@@ -58,78 +133,84 @@ class Emitter:
 
         # Change this opcode and num inputs if different
         if replace_expr.get_name() != match_expr.get_name():
-            out += f"  data.opSetOpcode(op, CPUI_{replace_expr.get_name()});\n"
-
-        num_match_args = match_expr.get_num_args()
-        num_replace_args = replace_expr.get_num_args()
-
-        for i in range(num_match_args, num_replace_args):
-            out += f"  op->insertInput({i});\n"
-        for i in range(num_replace_args, num_match_args):
-            out += f"  data.opRemoveInput(op, {i});\n"
-
-        # Change inputs
-        for i, replace_arg in enumerate(replace_expr.get_args()):
-            if isinstance(replace_arg, tokens.TOK_OPCODE):
-                out += self._emit_create_opcode(replace_arg, "op", i)
-            elif isinstance(replace_arg, tokens.TOK_VAR):
-                out += self._emit_create_var(replace_arg, "op", i)
-            else:
-                out += self._emit_create_const(replace_arg, "op", i)
+            parts.append(f"  data.opSetOpcode(op, {replace_expr._cpui});\n")
+
+        num_match_args = match_expr._num_args
+        num_replace_args = replace_expr._num_args
+
+        # Resize the input list and wire up the new inputs in a single pass
+        # over the replace arguments.
+        if num_replace_args > num_match_args:
+            parts.extend(f"  op->insertInput({i});\n" for i in range(num_match_args, num_replace_args))
+        elif num_replace_args < num_match_args:
+            parts.extend(f"  data.opRemoveInput(op, {i});\n" for i in range(num_replace_args, num_match_args))
 
-        out += (
+        for i, replace_arg in enumerate(replace_expr._args):
+            parts.append(self.visit(replace_arg, EmitContext(REPLACE_BUILD, "op", input_num=i)))
+
+        parts.append(
             "\n"
             "  return 1;\n"
             "}\n"
         )
 
-        return out
+        return "".join(parts)
 
     def _get_free_name(self, prefix: str) -> str:
-        for i in range(1000):
-            name = f"{prefix}_{i}"
-            if name not in self._variables:
-                self._variables.add(name)
-                return name
-
-        raise ValueError("Too many variables in use!")
-
-    def _emit_create_opcode(self, opcode: tokens.TOK_OPCODE, parent_op_name: str, input_num: int) -> str:
-        new_op_name = self._get_free_name("out_op")
-        new_out_varname = self._get_free_name("out_varnode")
-
-        out  = f"  PcodeOp* {new_op_name} = data.newOp({len(opcode._args)}, {parent_op_name}->getAddr());\n"
-        out += f"  data.opSetOpcode({new_op_name}, CPUI_{opcode._name});\n"
-        out += f"  Varnode* {new_out_varname} = data.newUniqueOut({opcode.get_size()}, {new_op_name});\n"
-        out += f"  data.opInsertBefore({new_op_name}, {parent_op_name});\n"
-        out += f"  data.opSetInput({parent_op_name}, {new_out_varname}, {input_num});\n\n"
+        # User variables can never collide with these names: they are prefixed
+        # with 'autovar_' and cannot contain digits, so a plain per-prefix
+        # counter suffices.
+        i = self._prefix_counters.get(prefix, 0)
+        self._prefix_counters[prefix] = i + 1
+
+        name = f"{prefix}_{i}"
+        self._variables.add(name)
+        return name
+
+    def _visit_build_opcode(self, opcode: tokens.TOK_OPCODE, ctx: EmitContext) -> str:
+        # Iterative pre-order walk with an explicit stack: deeply nested
+        # replace expressions cost no Python call frames and cannot hit the
+        # recursion limit.
+        parts: list[str] = []
+        stack = [(opcode, ctx)]
+
+        while stack:
+            node, node_ctx = stack.pop()
+
+            if not isinstance(node, tokens.TOK_OPCODE):
+                parts.append(self.visit(node, node_ctx))
+                continue
+
+            parent_op_name = node_ctx.target
+            new_op_name = self._get_free_name("out_op")
+            new_out_varname = self._get_free_name("out_varnode")
+
+            parts.append(
+                f"  PcodeOp* {new_op_name} = data.newOp({node._num_args}, {parent_op_name}->getAddr());\n"
+                f"  data.opSetOpcode({new_op_name}, {node._cpui});\n"
+                f"  Varnode* {new_out_varname} = data.newUniqueOut({node.get_size()}, {new_op_name});\n"
+                f"  data.opInsertBefore({new_op_name}, {parent_op_name});\n"
+                f"  data.opSetInput({parent_op_name}, {new_out_varname}, {node_ctx.input_num});\n\n"
+            )
 
-        for i, arg in enumerate(opcode._args):
-            if isinstance(arg, tokens.TOK_OPCODE):
-                out += self._emit_create_opcode(arg, new_op_name, i)
-            elif isinstance(arg, tokens.TOK_VAR):
-                out += self._emit_create_var(arg, new_op_name, i)
-            else:
-                out += self._emit_create_const(arg, new_op_name, i)
+            # pushed in reverse so the first argument is emitted first
+            for i in range(node._num_args - 1, -1, -1):
+                stack.append((node._args[i], EmitContext(REPLACE_BUILD, new_op_name, input_num=i)))
 
-        return out
+        return "".join(parts)
 
-    def _emit_create_var(self, variable: tokens.TOK_VAR, parent_op_name: str, input_number: int) -> str:
-        return f"  data.opSetInput({parent_op_name}, {variable.to_c()}, {input_number});\n"
+    def _visit_build_var(self, variable: tokens.TOK_VAR, ctx: EmitContext) -> str:
+        return f"  data.opSetInput({ctx.target}, {variable.to_c()}, {ctx.input_num});\n"
 
-    def _emit_create_const(self, constant: tokens.TOK_NUMBER | tokens.TOK_BINARY_OPERATION, parent_op_name: str, input_number: int):
+    def _visit_build_const(self, constant: tokens.TOK_NUMBER | tokens.TOK_BINARY_OPERATION, ctx: EmitContext) -> str:
         const_varnode_name = self._get_free_name("out_const")
-        out  = f"  Varnode* {const_varnode_name} = data.newConstant({constant.size_to_c()}, {constant.to_c()});\n"
-        out += f"  data.opSetInput({parent_op_name}, {const_varnode_name}, {input_number});\n"
+        const_c = constant.to_c()
+        size_c = constant.size_to_c()
+        out  = f"  Varnode* {const_varnode_name} = data.newConstant({size_c}, {const_c});\n"
+        out += f"  data.opSetInput({ctx.target}, {const_varnode_name}, {ctx.input_num});\n"
         return out
 
-    def _emit_declare_var(self, variable: tokens.TOK_VAR) -> str:
-        var_name = variable.to_c()
-
-        if var_name in self._declared_vars:
-            return ""
-
-        self._declared_vars.add(var_name)
+    def _emit_declare_var(self, var_name: str) -> str:
         return f"  Varnode* {var_name};\n"
 
     def _emit_create_varnode(self, var_name: str, var_source: str, num_indent: int) -> str:
@@ -138,10 +219,10 @@ class Emitter:
         else:
             type_name = ""
 
-        return f"{' ' * num_indent}{type_name}{var_name} = {var_source};\n"
+        return f"{_INDENT[num_indent]}{type_name}{var_name} = {var_source};\n"
 
     def _emit_check(self, left: str, op: str, right: str, num_indent: int) -> str:
-        return f"{' ' * num_indent}if ({left} {op} {right}) return 0;\n"
+        return f"{_INDENT[num_indent]}if ({left} {op} {right}) return 0;\n"
     def _emit_check_equality(self, name_a: str, name_b: str, num_indent: int) -> str:
         return self._emit_check(name_a, "!=", name_b, num_indent)
     def _emit_check_inequality(self, name_a: str, name_b: str, num_indent: int) -> str:
@@ -155,24 +236,62 @@ class Emitter:
     def _emit_check_less_equal(self, name_a: str, name_b: str, num_indent: int) -> str:
         return self._emit_check(name_a, ">", name_b, num_indent)
 
-    def _emit_check_is_constant(self, varnode_name: str, num_indent: int) -> str:
-        return f"{' ' * num_indent}if ((! {varnode_name}->isConstant()) return 0;"
+    def _emit_check_constant_compare_vars(self, left_name: str, right_name: str, op: str, num_indent: int) -> str:
+        """
+        Emits a check that both varnodes hold constants and that their values
+        compare as given. The sub-tests are side-effect free, so they are
+        combined with & into a single condition - one branch on the match path
+        instead of three.
+        """
+        return (
+            f"{_INDENT[num_indent]}if (! (({left_name}->isConstant()) & ({right_name}->isConstant())"
+            f" & ({left_name}->getOffset() {op} {right_name}->getOffset()))) return 0;\n"
+        )
+
+    def _emit_check_value_compare_var(self, value_c: str, var_name: str, op: str, num_indent: int) -> str:
+        """
+        Like _emit_check_constant_compare_vars, but the left side is an
+        already-scalar C expression (a number, sizeof or arithmetic over
+        them), so only the varnode side needs the isConstant guard and the
+        getOffset projection.
+        """
+        return (
+            f"{_INDENT[num_indent]}if (! (({var_name}->isConstant())"
+            f" & ({value_c} {op} {var_name}->getOffset()))) return 0;\n"
+        )
+
     def _emit_check_constant(self, varnode_name: str, op: str, const_val: tokens.TOK_NUMBER | tokens.TOK_BINARY_OPERATION, num_indent: int) -> str:
+        # A literal value with a literal size can be masked here instead of in
+        # the generated code.
+        if isinstance(const_val, tokens.TOK_NUMBER):
+            masked = const_val.try_literal_masked()
+            if masked is not None:
+                return f"{_INDENT[num_indent]}if ((! {varnode_name}->isConstant()) || ({varnode_name}->getOffset() {op} {masked})) return 0;\n"
+
+        const_c = const_val.to_c()
+
         if const_val._size == 8:
-            return f"{' ' * num_indent}if ((! {varnode_name}->isConstant()) || ({varnode_name}->getOffset() {op} {const_val.to_c()})) return 0;\n"
+            return f"{_INDENT[num_indent]}if ((! {varnode_name}->isConstant()) || ({varnode_name}->getOffset() {op} {const_c})) return 0;\n"
 
         return (
-            f"{' ' * num_indent}uintb masked_const = {const_val.to_c()} & ((((uintb) 1) << (8 * {const_val._size.to_c()})) - 1);\n"
-            f"{' ' * num_indent}if ((! {varnode_name}->isConstant()) || ({varnode_name}->getOffset() {op} masked_const)) return 0;\n"
+            f"{_INDENT[num_indent]}uintb masked_const = {const_c} & ((((uintb) 1) << (8 * {const_val.size_to_c()})) - 1);\n"
+            f"{_INDENT[num_indent]}if ((! {varnode_name}->isConstant()) || ({varnode_name}->getOffset() {op} masked_const)) return 0;\n"
         )
 
     def _emit_check_constant_equal(self, varnode_name: str, const_val: tokens.TOK_NUMBER | tokens.TOK_BINARY_OPERATION, num_indent: int) -> str:
+        if isinstance(const_val, tokens.TOK_NUMBER):
+            masked = const_val.try_literal_masked()
+            if masked is not None:
+                return f"{_INDENT[num_indent]}if (! {varnode_name}->constantMatch({masked})) return 0;\n"
+
+        const_c = const_val.to_c()
+
         if const_val._size == 8:
-            return f"{' ' * num_indent}if (! {varnode_name}->constantMatch({const_val.to_c()})) return 0;\n"
+            return f"{_INDENT[num_indent]}if (! {varnode_name}->constantMatch({const_c})) return 0;\n"
 
         return (
-            f"{' ' * num_indent}uintb masked_const = {const_val.to_c()} & ((((uintb) 1) << (8 * {const_val._size.to_c()})) - 1);\n"
-            f"{' ' * num_indent}if (! {varnode_name}->constantMatch(masked_const)) return 0;\n"
+            f"{_INDENT[num_indent]}uintb masked_const = {const_c} & ((((uintb) 1) << (8 * {const_val.size_to_c()})) - 1);\n"
+            f"{_INDENT[num_indent]}if (! {varnode_name}->constantMatch(masked_const)) return 0;\n"
         )
 
     def _emit_check_constant_not_equal(self, varnode_name: str, const_val: tokens.TOK_NUMBER | tokens.TOK_BINARY_OPERATION, num_indent: int) -> str:
@@ -188,37 +307,62 @@ class Emitter:
 
     def _emit_check_opcode(self, varnode: tokens.TOK_VAR, opcode: tokens.TOK_OPCODE, num_indent: int) -> str:
         # check that the varnode is not a constant
-        indent_str = " " * num_indent
-        out = f"{indent_str}if (! {varnode.to_c()}->isWritten()) return 0;\n"
+        indent_str = _INDENT[num_indent]
+        varnode_c = varnode.to_c()
+        parts = [f"{indent_str}if (! {varnode_c}->isWritten()) return 0;\n"]
 
         # extract the PcodeOp
         pcode_varname = self._get_free_name("temp_pcode")
-        out += f"{indent_str}PcodeOp* {pcode_varname} = {varnode.to_c()}->getDef();\n"
+        parts.append(f"{indent_str}PcodeOp* {pcode_varname} = {varnode_c}->getDef();\n")
 
         # check the PcodeOp's code
-        out += self._emit_check_equality(f"{pcode_varname}->code()", f"CPUI_{opcode._name}", num_indent)
+        parts.append(self._emit_check_equality(f"{pcode_varname}->code()", opcode._cpui, num_indent))
         # and its children
-        out += self._emit_check_opcode_children(pcode_varname, opcode, num_indent)
+        parts.append(self._emit_check_opcode_children(pcode_varname, opcode, num_indent))
 
-        return out
+        return "".join(parts)
+
+    def _visit_check_var(self, arg: tokens.TOK_VAR, ctx: EmitContext) -> str:
+        var_name = arg.to_c()
+
+        if var_name in self._variables:
+            # exists already - check for equality
+            return self._emit_check_equality(ctx.target, var_name, ctx.indent)
+
+        # does not yet exist - create
+        self._variables.add(var_name)
+        return self._emit_create_varnode(var_name, ctx.target, ctx.indent)
+
+    def _visit_check_constant(self, arg: tokens.TOK_NUMBER | tokens.TOK_BINARY_OPERATION, ctx: EmitContext) -> str:
+        return self._emit_check_constant_equal(ctx.target, arg, ctx.indent)
+
+    def _visit_check_opcode(self, arg: tokens.TOK_OPCODE, ctx: EmitContext) -> str:
+        if ctx.is_commutative:
+            return self._emit_check_opcode(tokens.TOK_VAR(ctx.target), arg, ctx.indent)
+
+        varnode_name = self._get_free_name("autovar")
+        return (
+            self._emit_create_varnode(varnode_name, ctx.target, ctx.indent)
+            + self._emit_check_opcode(tokens.TOK_VAR(varnode_name), arg, ctx.indent)
+        )
 
     def _emit_check_opcode_children(self, target: str, opcode: tokens.TOK_OPCODE, indentation = 2) -> str:
         # check the number of args - we could also hardcode this
-        indent_str = " " * indentation
+        indent_str = _INDENT[indentation]
 
-        out = (
+        parts = [
             "\n"
             f"{indent_str}// Checks {opcode.to_pretty()}\n"
-        )
+        ]
 
-        is_commutative = opcode._name in tokens.COMMUTATIVE_OP_NAMES
+        is_commutative = opcode._is_commutative
 
         if is_commutative:
             check_lambda_name = self._get_free_name("check_" + opcode.get_name().lower().rsplit("_", 1)[-1])
             varnode_left_name = self._get_free_name("autovar_left")
             varnode_right_name = self._get_free_name("autovar_right")
 
-            out += f"{indent_str}auto {check_lambda_name} = [&](Varnode* {varnode_left_name}, Varnode* {varnode_right_name}) -> int4 {{\n"
+            parts.append(f"{indent_str}auto {check_lambda_name} = [&](Varnode* {varnode_left_name}, Varnode* {varnode_right_name}) -> int4 {{\n")
             indentation += 2
 
         for i, arg in enumerate(opcode._args):
@@ -227,52 +371,30 @@ class Emitter:
             else:
                 target_arg = f"{target}->getIn({i})"
 
-
-            if isinstance(arg, tokens.TOK_VAR):
-                # variable
-                var_name = arg.to_c()
-                if var_name in self._variables:
-                    # exists already - check for equality
-                    out += self._emit_check_equality(target_arg, var_name, indentation)
-                else:
-                    # does not yet exist - create
-                    self._variables.add(var_name)
-                    out += self._emit_create_varnode(var_name, target_arg, indentation)
-
-            elif isinstance(arg, tokens.TOK_BINARY_OPERATION):
-                # maths
-                out += self._emit_check_constant_equal(target_arg, arg, indentation)
-
-            elif isinstance(arg, tokens.TOK_OPCODE):
-                # opcode
-                if is_commutative:
-                    varnode_name = target_arg
-                else:
-                    varnode_name = self._get_free_name("autovar")
-                    out += self._emit_create_varnode(varnode_name, target_arg, indentation)
-
-                out += self._emit_check_opcode(tokens.TOK_VAR(varnode_name), arg, indentation)
-
-            elif isinstance(arg, tokens.TOK_NUMBER):
-                # int
-                out += self._emit_check_constant_equal(target_arg, arg, indentation)
-
-            else:
-                raise ValueError(f"Unsupported OPNAME argument type {type(arg)}")
-
-            out += "\n"
+            parts.append(self.visit(arg, EmitContext(MATCH_CHECK, target_arg, indentation, is_commutative=is_commutative)))
+            parts.append("\n")
 
         if is_commutative:
+            if _TRY_COMMUTE_TEMPLATE not in self._preamble:
+                self._preamble.append(_TRY_COMMUTE_TEMPLATE)
+
             indentation -= 2
             name_a = self._get_free_name("autovar")
             name_b = self._get_free_name("autovar")
-            out += (
+            parts.append(
                 f"{indent_str}  return 1;\n"
                 f"{indent_str}}};\n\n" +
                 self._emit_create_varnode(name_a, f"{target}->getIn(0)", indentation) +
                 self._emit_create_varnode(name_b, f"{target}->getIn(1)", indentation) +
-                f"{indent_str}if ((! {check_lambda_name}({name_a}, {name_b})) && (! {check_lambda_name}({name_b}, {name_a})))\n"
+                f"{indent_str}if (! try_commute({name_a}, {name_b}, {check_lambda_name}))\n"
                 f"{indent_str}  return 0;\n"
             )
 
-        return out
+        return "".join(parts)
+
+    def get_preamble(self) -> str:
+        """
+        Returns the file-scope helper code that the emitted applyOp body
+        relies on. Only valid after emit_apply_op has run.
+        """
+        return "".join(self._preamble)
@@ -1,26 +1,45 @@
+import functools
+import os
+
 import pyparsing as pp
 
 import rule
 import tokens
 
+# Packrat memoization avoids exponential backtracking on the nested
+# alternatives in the grammar (infix_notation, opcode alternatives).
+pp.ParserElement.enable_packrat()
+
+# Maps an infix operator to the token class that represents it
+_BINOP_CLASSES = {
+    "+": tokens.TOK_BINOP_ADD,
+    "-": tokens.TOK_BINOP_SUB,
+    "*": tokens.TOK_BINOP_MULT,
+    "&": tokens.TOK_BINOP_AND,
+    "|": tokens.TOK_BINOP_OR,
+    "^": tokens.TOK_BINOP_XOR,
+    "<<": tokens.TOK_BINOP_LSHIFT,
+    ">>": tokens.TOK_BINOP_RSHIFT,
+}
+
+@functools.cache
 def get_grammar():
     # The name of the rule (such as: 'SignBitExtract')
     name = pp.Word("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789_")
 
-    # The name of a 'CPUI_' opcode in Ghidra (such as: 'INT_RIGHT')
-    opcode = pp.Or(tokens.ALL_OP_NAMES)
+    # The name of a 'CPUI_' opcode in Ghidra (such as: 'INT_RIGHT'). Sorted
+    # longest-first so MatchFirst can take the first hit instead of trying
+    # every alternative like pp.Or does.
+    opcode = pp.MatchFirst([
+        pp.Keyword(name)
+        for name in sorted(tokens.ALL_OP_NAMES, key=len, reverse=True)
+    ])
 
     # The name of a variable in the description (such as: 'shift_amount')
     variable = pp.Word("abcdefghijklmnopqrstuvwxyz_")
 
     # A number in base 10 or in hexadecimal if prefixed with '0x'
-    number = pp.Combine(pp.Or((
-        "0",
-        pp.Char("123456789") + pp.Char("0123456789")[...],
-        "-" + pp.Char("123456789") + pp.Char("0123456789")[...],
-        "0x0",
-        "0x" + pp.Char("123456789abcdefABCDEF") + pp.Char("0123456789abcdefABCDEF")[...],
-    )))
+    number = pp.Regex(r"0x[0-9a-fA-F]+|-?[1-9][0-9]*|0")
 
     # The size of a variable, or Varnode (such as '|shift_amount|')
     sizeof = "|" + variable + "|"
@@ -100,24 +119,11 @@ def get_grammar():
         left = parse_value_expr(results[0])
         right = parse_value_expr(results[2])
 
-        if op == "+":
-            return tokens.TOK_BINOP_ADD(left, right)
-        elif op == "-":
-            return tokens.TOK_BINOP_SUB(left, right)
-        elif op == "*":
-            return tokens.TOK_BINOP_MULT(left, right)
-        elif op == "&":
-            return tokens.TOK_BINOP_AND(left, right)
-        elif op == "|":
-            return tokens.TOK_BINOP_OR(left, right)
-        elif op == "^":
-            return tokens.TOK_BINOP_XOR(left, right)
-        elif op == "<<":
-            return tokens.TOK_BINOP_LSHIFT(left, right)
-        elif op == ">>":
-            return tokens.TOK_BINOP_RSHIFT(left, right)
-
-        raise ValueError(f"Unsupported operand: {op!r}")
+        binop_class = _BINOP_CLASSES.get(op)
+        if binop_class is None:
+            raise ValueError(f"Unsupported operand: {op!r}")
+
+        return binop_class(left, right)
 
     value_expr.set_parse_action(parse_value_expr)
 
@@ -141,6 +147,14 @@ def get_grammar():
     return rule
 
 def parse_description(file_name: str) -> rule.Rule:
+    # The hand-written parser in parser_fast.py accepts the same language but
+    # consumes tokens linearly instead of backtracking through the
+    # infix_notation levels, so it is the default. Set RULECHEF_PARSER to
+    # 'pyparsing' to cross-check a rule against this grammar.
+    if os.environ.get("RULECHEF_PARSER", "fast") == "fast":
+        import parser_fast
+        return parser_fast.parse_description(file_name)
+
     grammar = get_grammar()
 
     parsed_tokens = grammar.parse_file(file_name)
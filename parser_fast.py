@@ -0,0 +1,230 @@
+"""
+Hand-written recursive-descent parser for rule descriptions.
+
+Produces exactly the same token objects as the pyparsing grammar in
+parser.py, but tokenizes with a single regex and parses value expressions
+with precedence climbing, so its cost is linear in the input length instead
+of in the number of grammar alternatives. This parser is the default;
+setting the RULECHEF_PARSER environment variable to 'pyparsing' selects the
+reference grammar instead.
+"""
+import re
+
+import rule
+import tokens
+
+_TOKEN_RE = re.compile(
+    r"\s+"
+    r"|(?P<number>0x[0-9a-fA-F]+|[1-9][0-9]*|0)"
+    r"|(?P<name>[A-Za-z0-9_]+)"
+    r"|(?P<sym>:-|=>|<<|>>|[():,{}=<>|+\-*&^])"
+)
+
+# Binding strength of the value-expression operators; same associativity and
+# precedence as in C (and as the infix_notation levels in parser.py).
+_PRECEDENCE = {
+    "|": 1,
+    "^": 2,
+    "&": 3,
+    "<<": 4, ">>": 4,
+    "+": 5, "-": 5,
+    "*": 6,
+}
+
+# Maps an infix operator to the token class that represents it. Kept local so
+# this module does not need to import parser.py (and with it pyparsing).
+_BINOP_CLASSES = {
+    "+": tokens.TOK_BINOP_ADD,
+    "-": tokens.TOK_BINOP_SUB,
+    "*": tokens.TOK_BINOP_MULT,
+    "&": tokens.TOK_BINOP_AND,
+    "|": tokens.TOK_BINOP_OR,
+    "^": tokens.TOK_BINOP_XOR,
+    "<<": tokens.TOK_BINOP_LSHIFT,
+    ">>": tokens.TOK_BINOP_RSHIFT,
+}
+
+class _Parser:
+    def __init__(self, text: str):
+        self._tokens = []
+
+        pos = 0
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if match is None:
+                raise ValueError(f"Unexpected character {text[pos]!r} at offset {pos}")
+
+            pos = match.end()
+            kind = match.lastgroup
+            if kind is not None:  # skip whitespace
+                self._tokens.append((kind, match.group()))
+
+        self._pos = 0
+
+    def _peek(self) -> str | None:
+        if self._pos >= len(self._tokens):
+            return None
+        return self._tokens[self._pos][1]
+
+    def _peek_kind(self) -> str | None:
+        if self._pos >= len(self._tokens):
+            return None
+        return self._tokens[self._pos][0]
+
+    def _next(self) -> str:
+        if self._pos >= len(self._tokens):
+            raise ValueError("Unexpected end of rule description")
+
+        text = self._tokens[self._pos][1]
+        self._pos += 1
+        return text
+
+    def _expect(self, expected: str) -> str:
+        got = self._next()
+        if got != expected:
+            raise ValueError(f"Expected {expected!r} but found {got!r}")
+        return got
+
+    def parse_rule(self) -> rule.Rule:
+        rule_name = self._next()
+        self._expect(":")
+
+        match_expr = self._parse_opcode_expr()
+
+        constraints = []
+        if self._peek() == ":-":
+            self._next()
+            self._expect("{")
+            while self._peek() != "}":
+                constraints.append(self._parse_constraint())
+            self._next()
+
+        self._expect("=>")
+        replace_expr = self._parse_replace_expr()
+
+        if self._pos != len(self._tokens):
+            raise ValueError(f"Trailing input after rule: {self._peek()!r}")
+
+        return rule.Rule(rule_name, match_expr, constraints, replace_expr)
+
+    def _parse_constraint(self) -> tokens.TOK_CONSTRAINT:
+        left = self._parse_value_expr()
+
+        comparison = self._next()
+        if comparison not in ("<", ">", "="):
+            raise ValueError(f"Expected a comparison operator but found {comparison!r}")
+
+        return tokens.TOK_CONSTRAINT(left, comparison, self._parse_expr())
+
+    def _parse_expr(self) -> tokens.Token:
+        # An opcode name always starts an opcode expression (with optional
+        # alternatives); anything else is a value expression.
+        if self._peek_kind() == "name" and self._peek() in tokens.ALL_OP_NAMES_SET:
+            return self._parse_opcode_alt_expr()
+
+        return self._parse_value_expr()
+
+    def _parse_opcode_alt_expr(self) -> tokens.Token:
+        elements = [self._parse_opcode_expr()]
+
+        while self._peek() == "|":
+            self._next()
+            if self._peek_kind() == "name" and self._peek() in tokens.ALL_OP_NAMES_SET:
+                elements.append(self._parse_opcode_expr())
+            else:
+                elements.append(self._parse_variable())
+
+        if len(elements) == 1:
+            return elements[0]
+
+        return tokens.TOK_OPCODE_OR(tuple(elements))
+
+    def _parse_opcode_expr(self) -> tokens.TOK_OPCODE:
+        name = self._next()
+        if name not in tokens.ALL_OP_NAMES_SET:
+            raise ValueError(f"Expected an opcode name but found {name!r}")
+
+        self._expect("(")
+        args = [self._parse_expr()]
+        while self._peek() == ",":
+            self._next()
+            args.append(self._parse_expr())
+        self._expect(")")
+
+        return tokens.TOK_OPCODE(name, args)
+
+    def _parse_replace_expr(self) -> tokens.TOK_OPCODE | tokens.TOK_VAR:
+        if self._peek_kind() == "name" and self._peek() in tokens.ALL_OP_NAMES_SET:
+            return self._parse_opcode_expr()
+
+        return self._parse_variable()
+
+    def _parse_value_expr(self, min_precedence: int = 1) -> tokens.Token:
+        left = self._parse_value_operand()
+
+        while True:
+            op = self._peek()
+            precedence = _PRECEDENCE.get(op) if op is not None else None
+            if precedence is None or precedence < min_precedence:
+                return left
+
+            self._next()
+            # all operators are left-associative, so the right side binds
+            # one level tighter
+            right = self._parse_value_expr(precedence + 1)
+            left = _BINOP_CLASSES[op](left, right)
+
+    def _parse_value_operand(self) -> tokens.Token:
+        kind = self._peek_kind()
+
+        if kind == "sym":
+            sym = self._peek()
+
+            if sym == "(":
+                self._next()
+                value = self._parse_value_expr()
+                self._expect(")")
+                return value
+
+            if sym == "|":
+                return self._parse_sizeof()
+
+            if sym == "-" and self._pos + 1 < len(self._tokens) and self._tokens[self._pos + 1][0] == "number":
+                self._next()
+                return self._parse_sized_number("-" + self._next())
+
+        if kind == "number":
+            return self._parse_sized_number(self._next())
+
+        if kind == "name":
+            return self._parse_variable()
+
+        raise ValueError(f"Expected a value but found {self._peek()!r}")
+
+    def _parse_sized_number(self, value: str) -> tokens.TOK_NUMBER:
+        if self._peek() != ":":
+            return tokens.TOK_NUMBER(value, "8")
+
+        self._next()
+        if self._peek() == "|":
+            return tokens.TOK_NUMBER(value, self._parse_sizeof())
+
+        size = self._next()
+        return tokens.TOK_NUMBER(value, size)
+
+    def _parse_sizeof(self) -> tokens.TOK_SIZEOF:
+        self._expect("|")
+        variable = self._parse_variable()
+        self._expect("|")
+        return tokens.TOK_SIZEOF(variable)
+
+    def _parse_variable(self) -> tokens.TOK_VAR:
+        name = self._next()
+        if not re.fullmatch(r"[a-z_]+", name):
+            raise ValueError(f"Expected a variable name but found {name!r}")
+
+        return tokens.TOK_VAR("autovar_" + name)
+
+def parse_description(file_name: str) -> rule.Rule:
+    with open(file_name, "r", encoding="utf-8") as f:
+        return _Parser(f.read()).parse_rule()
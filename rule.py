@@ -8,15 +8,24 @@ class Rule:
         self._constraints = constraints
         self._replace_expr = replace_expr
 
+        # The replace-expression variables must be forward-declared in the
+        # generated applyOp body; compute the set once here.
+        self._replace_vars = frozenset(v.to_c() for v in replace_expr.get_variables())
+
     def emit_c_code(self) -> str:
         explanation_comment = self._get_explanation_docstring()
         header = self._emit_header()
         get_oplist = self._emit_get_oplist()
 
-        emitter = emit.Emitter()
+        emitter = emit.Emitter(declared_vars=self._replace_vars)
         apply_op = emitter.emit_apply_op(self._name, self._match_expr, self._constraints, self._replace_expr)
+        preamble = emitter.get_preamble()
+
+        pieces = [header, "", explanation_comment, get_oplist, "", apply_op]
+        if preamble:
+            pieces[1:1] = [preamble]
 
-        return "\n".join((header, "", explanation_comment, get_oplist, "", apply_op))
+        return "\n".join(pieces)
 
     def _emit_header(self) -> str:
         return (
@@ -36,7 +45,7 @@ class Rule:
         return (
             f"void RuleSimplify{self._name}::getOpList(vector<uint4> &oplist) const\n"
             "{\n"
-            f"  oplist.push_back(CPUI_{self._match_expr.get_name()});\n"
+            f"  oplist.push_back({tokens.CPUI_NAMES[self._match_expr.get_name()]});\n"
             "}\n"
         )
 
@@ -1,28 +1,79 @@
-import sys
+import argparse
+import concurrent.futures
+import glob
+import os
 
 import parser
 
+def compile_rule_file(rule_file_name: str, out_file_name: str) -> None:
+    """
+    Parses the rule description in the given file and writes the generated
+    C++ code to the given output file.
+    """
+    rule = parser.parse_description(rule_file_name)
+    code = rule.emit_c_code()
+
+    with open(out_file_name, "w", encoding="utf-8") as f:
+        f.write(code)
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage:")
-        print(f"python {sys.argv[0]} infile [outfile]")
-        print("    infile   the path to the file containing the rule description")
-        print("    outfile  (optional) the path to the file where the code will be output")
-        print("             if not specified, the output is printed to standard out")
-        return
+    arg_parser = argparse.ArgumentParser(
+        description="Translates declarative simplification rule descriptions "
+                    "into C++ code for Ghidra's decompiler."
+    )
+    arg_parser.add_argument(
+        "infile",
+        help="the path to the file containing the rule description, or (with "
+             "--batch) to a directory of .txt rule descriptions")
+    arg_parser.add_argument(
+        "outfile", nargs="?",
+        help="the path to the file where the code will be output; if not "
+             "specified, the output is printed to standard out (required "
+             "with --batch: the directory where the code will be output)")
+    arg_parser.add_argument(
+        "--batch", action="store_true",
+        help="compile every .txt rule description in the infile directory "
+             "into a .cc file in the outfile directory")
+    arg_parser.add_argument(
+        "--jobs", type=int, default=1, metavar="N",
+        help="with --batch, compile rules in N processes in parallel")
+    args = arg_parser.parse_args()
 
-    rule_file_name = sys.argv[1]
-    out_file_name = sys.argv[2] if len(sys.argv) > 2 else None
+    if not args.batch:
+        rule = parser.parse_description(args.infile)
+        code = rule.emit_c_code()
 
-    rule = parser.parse_description(rule_file_name)
-    code = rule.emit_c_code()
+        if args.outfile is None:
+            print(code)
+            return
 
-    if out_file_name is None:
-        print(code)
+        with open(args.outfile, "w", encoding="utf-8") as f:
+            f.write(code)
         return
 
-    with open(out_file_name, "w", encoding="utf-8") as f:
-        f.write(code)
+    if args.outfile is None:
+        arg_parser.error("--batch requires an output directory")
+
+    rule_files = sorted(glob.glob(os.path.join(args.infile, "*.txt")))
+    if not rule_files:
+        arg_parser.error(f"no .txt rule descriptions found in {args.infile!r}")
+
+    os.makedirs(args.outfile, exist_ok=True)
+
+    out_files = [
+        os.path.join(args.outfile, os.path.splitext(os.path.basename(f))[0] + ".cc")
+        for f in rule_files
+    ]
+
+    if args.jobs > 1:
+        # one process pays the import + grammar cost once per worker instead
+        # of once per rule
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            for _ in executor.map(compile_rule_file, rule_files, out_files):
+                pass
+    else:
+        for rule_file, out_file in zip(rule_files, out_files):
+            compile_rule_file(rule_file, out_file)
 
 if __name__ == "__main__":
     main()
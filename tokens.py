@@ -1,3 +1,5 @@
+import operator
+import sys
 import typing
 
 ALL_OP_NAMES = (
@@ -16,13 +18,25 @@ ALL_OP_NAMES = (
     "NEW", "INSERT", "EXTRACT", "POPCOUNT"
 )
 
+# Frozenset views of the name tuples above, for O(1) membership tests. The
+# tuples stay the public ordered form; these are the lookup form.
+ALL_OP_NAMES_SET = frozenset(ALL_OP_NAMES)
+
+# The Ghidra 'CPUI_' enumerator for every opcode, interned once so the many
+# emit sites share a single string object per opcode
+CPUI_NAMES = {name: sys.intern("CPUI_" + name) for name in ALL_OP_NAMES}
+
 COMMUTATIVE_OP_NAMES = (
     "INT_EQUAL", "INT_NOTEQUAL", "INT_ADD", "INT_XOR", "INT_AND", "INT_OR",
     "INT_MULT", "BOOL_XOR", "BOOL_AND", "BOOL_OR", "FLOAT_EQUAL", "FLOAT_NOTEQUAL",
     "FLOAT_ADD", "FLOAT_MULT",
 )
 
+COMMUTATIVE_OP_NAMES_SET = frozenset(COMMUTATIVE_OP_NAMES)
+
 class Token:
+    __slots__ = ()
+
     def to_c(self) -> str:
         """
         Returns a string that contains valid C code that represents this token.
@@ -44,8 +58,16 @@ class Token:
 
 
 class TOK_VAR(Token):
+    __slots__ = ("_name", "_pretty", "_vars")
+
     def __init__(self, name):
         self._name = name
+        self._vars = (self,)
+
+        if name.startswith('autovar_'):
+            self._pretty = name[len('autovar_'):]
+        else:
+            self._pretty = name
 
     def __eq__(self, other: 'TOK_VAR') -> bool:
         return isinstance(other, TOK_VAR) and self._name == other._name
@@ -57,7 +79,7 @@ class TOK_VAR(Token):
         return f"VAR({self._name!r})"
 
     def to_c(self) -> str:
-        return f"{self._name}"
+        return self._name
 
     def get_size(self) -> typing.Optional[int]:
         """
@@ -68,16 +90,19 @@ class TOK_VAR(Token):
         return None
 
     def to_pretty(self) -> str:
-        if self._name.startswith('autovar_'):
-            return self._name[len('autovar_'):]
-        return self._name
+        return self._pretty
 
     def get_variables(self):
-        yield self
+        return self._vars
 
 class TOK_SIZEOF(Token):
+    __slots__ = ("_variable", "_c", "_pretty", "_vars")
+
     def __init__(self, variable: TOK_VAR):
         self._variable = variable
+        self._vars = (variable,)
+        self._c = f"{variable.to_c()}->getSize()"
+        self._pretty = f"|{variable.to_pretty()}|"
 
     def __repr__(self) -> str:
         return f"SIZEOF({self._variable!r})"
@@ -86,24 +111,32 @@ class TOK_SIZEOF(Token):
         return 8
 
     def to_c(self) -> str:
-        return f"{self._variable.to_c()}->getSize()"
+        return self._c
 
     def to_pretty(self) -> str:
-        return f"|{self._variable.to_pretty()}|"
+        return self._pretty
 
     def get_variables(self):
-        yield self._variable
+        return self._vars
 
 class TOK_NUMBER(Token):
-    def __init__(self, val: str, size: str):
+    __slots__ = ("_val", "_size", "_val_repr", "_size_val", "_size_c", "_pretty", "_vars")
+
+    def __init__(self, val: str, size: 'str | TOK_SIZEOF'):
         self._val = int(val, 0)
         self._size = size
         self._val_repr = val
 
-        if isinstance(size, str):
-            self._size_val = int(size, 0)
-        else:
+        if isinstance(size, TOK_SIZEOF):
             self._size_val = None
+            self._size_c = size.to_c()
+            self._vars = size.get_variables()
+            self._pretty = val + ":" + size.to_pretty()
+        else:
+            self._size_val = int(size, 0)
+            self._size_c = size
+            self._vars = ()
+            self._pretty = val if self._size_val == 8 else val + ":" + size
 
     def __repr__(self) -> str:
         return f"NUMBER({self._val_repr}, {self._size!r})"
@@ -112,28 +145,43 @@ class TOK_NUMBER(Token):
         return self._val_repr
 
     def size_to_c(self) -> str:
-        if isinstance(self._size, str):
-            return self._size
-
-        assert isinstance(self._size, TOK_SIZEOF)
-        return self._size.to_c()
-
-    def to_pretty(self) -> str:
-        if self._size_val == 8:
-            return self._val_repr
+        return self._size_c
 
+    def try_literal_masked(self) -> typing.Optional[str]:
+        """
+        If both the value and the size of this number are literals, returns
+        the value masked to the size, as a hexadecimal C literal. Returns None
+        if the size is only known at runtime (a sizeof expression).
+        """
         if self._size_val is None:
-            return self._val_repr + ":" + self._size.to_pretty()
+            return None
 
-        return self._val_repr + ":" + self._size
+        return hex(self._val & ((1 << (8 * self._size_val)) - 1))
 
-    def get_variables(self):
-        if self._size_val is not None:
-            return
+    def to_pretty(self) -> str:
+        return self._pretty
 
-        yield from self._size.get_variables()
+    def get_variables(self):
+        return self._vars
+
+# The Python equivalent of each binary operation's C operator
+_PY_BINOPS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "&": operator.and_,
+    "|": operator.or_,
+    "^": operator.xor,
+    "<<": operator.lshift,
+    ">>": operator.rshift,
+}
+
+# Sentinel for "get_size has not run yet" - None is a valid result, so it
+# cannot double as the unset marker.
+_SIZE_UNCOMPUTED = object()
 
 class TOK_BINARY_OPERATION(Token):
+    __slots__ = ("_left", "_right", "_vars", "_c_cache", "_pretty_cache", "_size_cache")
     _name = "TOK_BINARY_OPERATION"
     _c_token = "?"
     _size = 8  # Ghidra's uintb type is 8 bytes wide
@@ -141,30 +189,132 @@ class TOK_BINARY_OPERATION(Token):
     def __init__(self, left: 'op', right: 'op'):
         self._left = left
         self._right = right
+        self._vars = left.get_variables() + right.get_variables()
+
+        # Operations are immutable once built, so the rendered strings can be
+        # cached - the emitter renders the same subtree many times.
+        self._c_cache = None
+        self._pretty_cache = None
+        self._size_cache = _SIZE_UNCOMPUTED
 
     def __repr__(self) -> str:
         return f"{self._name}({self._left!r}, {self._right!r})"
 
     def to_c(self) -> str:
-        return f"({self._left.to_c()} {self._c_token} {self._right.to_c()})"
+        if self._c_cache is None:
+            # plain concatenation skips the f-string formatting machinery,
+            # which is measurable on deeply nested expressions
+            self._c_cache = "(" + self._left.to_c() + " " + self._c_token + " " + self._right.to_c() + ")"
+        return self._c_cache
 
     def get_size(self) -> int:
-        assert left.get_size() == right.get_size()
-        return left.get_size()
+        if self._size_cache is _SIZE_UNCOMPUTED:
+            size = self._left.get_size()
+            assert size == self._right.get_size()
+            self._size_cache = size
+        return self._size_cache
 
     def to_pretty(self) -> str:
         # TODO: The token used for this operation in C might not be the same as
         # the token used for this operation in the rule specification grammar.
-        return f"({self._left.to_pretty()} {self._c_token} {self._right.to_pretty()})"
+        if self._pretty_cache is None:
+            self._pretty_cache = "(" + self._left.to_pretty() + " " + self._c_token + " " + self._right.to_pretty() + ")"
+        return self._pretty_cache
 
     def get_variables(self):
-        yield from self._left.get_variables()
-        yield from self._right.get_variables()
+        return self._vars
+
+    def fold(self) -> 'Token':
+        """
+        Returns a TOK_NUMBER with the evaluated value if both sides of this
+        operation are literal numbers of the same (literal) size, so the
+        generated C does not have to redo the arithmetic at runtime. Also
+        applies the operator identities (x + 0, x * 1, x & 0, ...) that hold
+        regardless of the non-literal side's value. Returns this token
+        unchanged otherwise. Because expressions are built bottom-up, the
+        children have already been folded where possible.
+        """
+        left = self._left
+        right = self._right
+        op = self._c_token
+
+        if isinstance(left, TOK_NUMBER) and isinstance(right, TOK_NUMBER):
+            if left._size_val is None or left._size_val != right._size_val:
+                return self
+
+            try:
+                value = _PY_BINOPS[op](left._val, right._val)
+            except ValueError:
+                # e.g. a negative shift count - leave the expression for the
+                # C++ compiler to complain about instead of crashing here
+                return self
+
+            return TOK_NUMBER(str(value), left._size)
+
+        if isinstance(right, TOK_NUMBER):
+            if right._val == 0:
+                if op in ("+", "-", "|", "^", "<<", ">>"):
+                    return left
+                if op in ("*", "&"):
+                    return right
+
+            if right._val == 1 and op == "*":
+                return left
+
+        if isinstance(left, TOK_NUMBER):
+            if left._val == 0:
+                if op in ("+", "|", "^"):
+                    return right
+                if op in ("*", "&"):
+                    return left
+
+            if left._val == 1 and op == "*":
+                return right
+
+        return self
+
+# How an opcode's output size relates to its inputs (see get_size): same size
+# as input 0, a single boolean byte, or the sum of both inputs (PIECE).
+# Opcodes that are absent have no input-derivable output size.
+_SIZE_SAME_AS_INPUT = 0
+_SIZE_BOOL = 1
+_SIZE_PIECE = 2
+
+_OPCODE_SIZE_KIND = {name: _SIZE_SAME_AS_INPUT for name in (
+    "COPY", "INT_ADD", "INT_SUB", "INT_2COMP", "INT_NEGATE",
+    "INT_XOR", "INT_AND", "INT_OR", "INT_LEFT", "INT_RIGHT",
+    "INT_SRIGHT", "INT_MULT", "INT_DIV", "INT_REM", "INT_SDIV",
+    "INT_SREM", "FLOAT_ADD", "FLOAT_SUB", "FLOAT_MULT", "FLOAT_DIV",
+    "FLOAT_NEG", "FLOAT_ABS", "FLOAT_SQRT", "FLOAT_CEIL",
+    "FLOAT_FLOOR", "FLOAT_ROUND",
+)}
+_OPCODE_SIZE_KIND.update({name: _SIZE_BOOL for name in (
+    "INT_EQUAL", "INT_NOTEQUAL", "INT_LESS", "INT_SLESS",
+    "INT_LESSEQUAL", "INT_SLESSEQUAL", "INT_CARRY", "INT_SCARRY",
+    "INT_SBORROW", "BOOL_NEGATE", "BOOL_XOR", "BOOL_AND", "BOOL_OR",
+    "FLOAT_EQUAL", "FLOAT_NOTEQUAL", "FLOAT_LESS", "FLOAT_LESSEQUAL",
+    "FLOAT_NAN",
+)})
+_OPCODE_SIZE_KIND["PIECE"] = _SIZE_PIECE
 
 class TOK_OPCODE(Token):
+    __slots__ = ("_name", "_args", "_num_args", "_is_commutative", "_cpui", "_vars", "_size_cache")
+
     def __init__(self, name: str, args: list['args']):
-        self._name = name
-        self._args = tuple(args)
+        assert name in ALL_OP_NAMES_SET, f"Unknown opcode name {name!r}"
+
+        # Interned, so comparisons and dict lookups on the name are a pointer
+        # check instead of a string hash.
+        self._name = sys.intern(name)
+        self._args = args if type(args) is tuple else tuple(args)
+
+        # Derived attributes the emitter needs on every visit - compute them
+        # once here instead of on each recursive emit call.
+        self._num_args = len(self._args)
+        self._is_commutative = name in COMMUTATIVE_OP_NAMES_SET
+        self._cpui = CPUI_NAMES[name]
+        self._vars = tuple(v for arg in self._args for v in arg.get_variables())
+        self._size_cache = _SIZE_UNCOMPUTED
 
     def __repr__(self) -> str:
         return f"TOK_OPCODE({self._name}, {self._args})"
@@ -176,8 +326,7 @@ class TOK_OPCODE(Token):
         return self._args
 
     def get_variables(self) -> [TOK_VAR]:
-        for arg in self._args:
-            yield from arg.get_variables()
+        return self._vars
 
     def get_size_hint(self):
         """
@@ -192,47 +341,43 @@ class TOK_OPCODE(Token):
         Returns the size of the output varnode of this opcode. See:
         https://github.com/NationalSecurityAgency/ghidra/blob/master/GhidraDocs/languages/html/pcodedescription.html
         """
-        if self._name == "PIECE":
-            # Output size is the sum of the sizes of the (2) inputs
-            return self._args[0].get_size() + self._args[1].get_size(),
-
-        if self._name in {
-            "COPY", "INT_ADD", "INT_SUB", "INT_2COMP", "INT_NEGATE",
-            "INT_XOR", "INT_AND", "INT_OR", "INT_LEFT", "INT_RIGHT",
-            "INT_SRIGHT", "INT_MULT", "INT_DIV", "INT_REM", "INT_SDIV",
-            "INT_SREM", "FLOAT_ADD", "FLOAT_SUB", "FLOAT_MULT", "FLOAT_DIV",
-            "FLOAT_NEG", "FLOAT_ABS", "FLOAT_SQRT", "FLOAT_CEIL",
-            "FLOAT_FLOOR", "FLOAT_ROUND"
-        }:
+        if self._size_cache is _SIZE_UNCOMPUTED:
+            self._size_cache = self._compute_size()
+        return self._size_cache
+
+    def _compute_size(self) -> typing.Optional[int]:
+        kind = _OPCODE_SIZE_KIND.get(self._name)
+
+        if kind == _SIZE_SAME_AS_INPUT:
             # Output is the same size as input
             return self._args[0].get_size()
 
-        if self._name in {
-            "INT_EQUAL", "INT_NOTEQUAL", "INT_LESS", "INT_SLESS",
-            "INT_LESSEQUAL", "INT_SLESSEQUAL", "INT_CARRY", "INT_SCARRY",
-            "INT_SBORROW", "BOOL_NEGATE", "BOOL_XOR", "BOOL_AND", "BOOL_OR",
-            "FLOAT_EQUAL", "FLOAT_NOTEQUAL", "FLOAT_LESS", "FLOAT_LESSEQUAL",
-            "FLOAT_NAN"
-        }:
+        if kind == _SIZE_BOOL:
             # Output is a boolean - output is a single byte
             return 1
 
+        if kind == _SIZE_PIECE:
+            # Output size is the sum of the sizes of the (2) inputs
+            return self._args[0].get_size() + self._args[1].get_size()
+
         # Opcode is not in reference or output size is not related to input size
         return None
 
     def get_num_args(self) -> int:
-        # TODO: This should probably be a name-based lookup, similar to get_size
-        return len(self._args)
+        return self._num_args
 
     def to_pretty(self) -> str:
         return f"{self._name}({', '.join([a.to_pretty() for a in self._args])})"
 
 class TOK_CONSTRAINT(Token):
+    __slots__ = ("_left", "_comparison_op", "_right", "_or_func_name", "_vars")
+
     def __init__(self, left, comparison, right):
         self._left = left
         self._comparison_op = comparison
         self._right = right
         self._or_func_name = None  # only used when the right side is a TOK_OPCODE_OR
+        self._vars = left.get_variables() + right.get_variables()
 
     def to_check_c(self, emitter: "emit.Emitter", indent_level: int) -> tuple[str, int]:
         if isinstance(self._right, TOK_OPCODE_OR):
@@ -244,20 +389,31 @@ class TOK_CONSTRAINT(Token):
 
             assert not any([isinstance(e, TOK_VAR) for e in self._right._elements]), "Comparing two variables for equality is not supported - use as few variables as possible."
 
-            return (
+            # A switch dispatches on the option id directly instead of walking
+            # an if/else-if cascade; each failed check returns 0, so reaching
+            # the break means the option matched.
+            pieces = [
                 "\n"
                 f"{indent_str}auto {self._or_func_name} = [&](int4 {option_name}) -> int4 {{\n"
-                f"{indent_str}  if ({option_name} == 0) {{\n" +
-                emitter._emit_check_opcode(self._left, self._right._elements[0], indent_level + 4) +
-                "".join([
-                    f"{indent_str}  }} else if ({option_name} == {i}) {{\n" +
-                    emitter._emit_check_opcode(self._left, self._right._elements[i], indent_level + 4)
-                    for i in range(1, len(self._right._elements) - 1)
-                ]) +
-                f"{indent_str}  }} else {{\n" +
-                emitter._emit_check_opcode(self._left, self._right._elements[-1], indent_level + 4) +
+                f"{indent_str}  switch ({option_name}) {{\n"
+            ]
+
+            for i in range(len(self._right._elements) - 1):
+                pieces.append(f"{indent_str}  case {i}: {{\n")
+                pieces.append(emitter._emit_check_opcode(self._left, self._right._elements[i], indent_level + 4))
+                pieces.append(
+                    f"{indent_str}    break;\n"
+                    f"{indent_str}  }}\n"
+                )
+
+            pieces.append(f"{indent_str}  default: {{\n")
+            pieces.append(emitter._emit_check_opcode(self._left, self._right._elements[-1], indent_level + 4))
+            pieces.append(
+                f"{indent_str}  }}\n"
                 f"{indent_str}  }}\n\n"
-            ), indent_level + 2
+            )
+
+            return "".join(pieces), indent_level + 2
 
         match self._comparison_op:
             case "=":
@@ -269,7 +425,7 @@ class TOK_CONSTRAINT(Token):
 
                 assert not isinstance(self._right, TOK_VAR), "Comparing two variables for equality is not supported - use as few variables as possible."
 
-                return emitter._emit_check_constant_equal(self._left.to_c(), self._right.to_c(), indent_level), indent_level
+                return emitter._emit_check_constant_equal(self._left.to_c(), self._right, indent_level), indent_level
 
             case "<":
                 if self._left == self._right:
@@ -281,14 +437,14 @@ class TOK_CONSTRAINT(Token):
                     var_name = self._right.to_c()
                     assert var_name in emitter._variables, "Cannot create new variable in constraint"
 
-                    return (
-                        emitter._emit_check_is_constant(var_name, indent_level)
-                        + emitter._emit_check_constant_less(self._left.to_c(), f"{var_name}->getOffset()", indent_level)
-                    ), indent_level
+                    if isinstance(self._left, TOK_VAR):
+                        return emitter._emit_check_constant_compare_vars(self._left.to_c(), var_name, "<", indent_level), indent_level
+
+                    return emitter._emit_check_value_compare_var(self._left.to_c(), var_name, "<", indent_level), indent_level
 
                 if isinstance(self._right, (TOK_BINARY_OPERATION, TOK_NUMBER)):
                     # some operations that will evaluate to a constant
-                    return emitter._emit_check_constant_less(self._left.to_c(), self._right.to_c(), indent_level), indent_level
+                    return emitter._emit_check_constant_less(self._left.to_c(), self._right, indent_level), indent_level
 
             case ">":
                 if self._left == self._right:
@@ -300,33 +456,53 @@ class TOK_CONSTRAINT(Token):
                     var_name = self._right.to_c()
                     assert var_name in emitter._variables, "Cannot create new variable in constraint"
 
-                    return (
-                        emitter._emit_check_is_constant(var_name, indent_level)
-                        + emitter._emit_check_constant_greater(self._left.to_c(), f"{var_name}->getOffset()", indent_level)
-                    ), indent_level
+                    if isinstance(self._left, TOK_VAR):
+                        return emitter._emit_check_constant_compare_vars(self._left.to_c(), var_name, ">", indent_level), indent_level
+
+                    return emitter._emit_check_value_compare_var(self._left.to_c(), var_name, ">", indent_level), indent_level
 
                 if isinstance(self._right, (TOK_BINARY_OPERATION, TOK_NUMBER)):
                     # some operations that will evaluate to a constant
-                    return emitter._emit_check_constant_greater(self._left.to_c(), self._right.to_c(), indent_level)
+                    return emitter._emit_check_constant_greater(self._left.to_c(), self._right, indent_level), indent_level
 
-        raise ValueError(f"Unsupported type: {self._comparison_op!r} constraint with variable and {type(check_val)} in constraint.")
+        raise ValueError(f"Unsupported type: {self._comparison_op!r} constraint with variable and {type(self._right)} in constraint.")
 
     def to_check_c_end(self, emitter: "emit.Emitter", indent_level: int) -> str:
         assert isinstance(self._right, TOK_OPCODE_OR)
 
         indent_str = " " * indent_level
+        num_options = len(self._right._elements)
+
+        # Typical ORs have two or three options - unroll those into a single
+        # condition so the C++ compiler can inline the lambda calls, instead
+        # of looping over an induction variable.
+        if num_options <= 4:
+            all_failed = " && ".join(
+                f"({self._or_func_name}({i}) == 0)" for i in range(num_options)
+            )
+
+            return (
+                f"{indent_str}}}\n"
+                f"\n"
+                f"{indent_str}if ({all_failed})\n"
+                f"{indent_str}  return 0;\n"
+                f"{indent_str}}}\n"
+            )
+
         it_var = emitter._get_free_name("i")
+        bound_var = emitter._get_free_name("num_options")
 
         return (
             f"{indent_str}}}\n"
             f"\n"
+            f"{indent_str}constexpr int4 {bound_var} = {num_options};\n"
             f"{indent_str}int4 {it_var};\n"
-            f"{indent_str}for ({it_var} = 0; {it_var} < {len(self._right._elements)}; {it_var}++) {{;\n"
+            f"{indent_str}for ({it_var} = 0; {it_var} < {bound_var}; {it_var}++) {{;\n"
             f"{indent_str}  if ({self._or_func_name}({it_var}) != 0)\n"
             f"{indent_str}    break;\n"
             f"{indent_str}}}\n"
             f"\n"
-            f"{indent_str}if ({it_var} == {len(self._right._elements)})\n"
+            f"{indent_str}if ({it_var} == {bound_var})\n"
             f"{indent_str}  return 0;\n"
             f"{indent_str}}}\n"
         )
@@ -335,8 +511,7 @@ class TOK_CONSTRAINT(Token):
         return f"TOK_CONSTRAINT({self._left!r}, {self._comparison_op!r}, {self._right!r})"
 
     def get_variables(self):
-        yield from self._left.get_variables()
-        yield from self._right.get_variables()
+        return self._vars
 
     def get_size(self) -> typing.Optional[int]:
         """
@@ -348,9 +523,12 @@ class TOK_CONSTRAINT(Token):
         return f"{self._left.to_pretty()} {self._comparison_op} {self._right.to_pretty()}\n"
 
 class TOK_OPCODE_OR(Token):
+    __slots__ = ("_elements", "_vars")
+
     def __init__(self, elements: tuple[TOK_OPCODE | TOK_VAR]):
         assert len(elements) > 1
         self._elements = elements
+        self._vars = tuple(v for element in elements for v in element.get_variables())
 
     def __repr__(self) -> str:
         return f"TOK_OPCODE_OR{self._elements!r}"
@@ -362,37 +540,50 @@ class TOK_OPCODE_OR(Token):
         return " | ".join((e.to_pretty() for e in self._elements))
 
     def get_variables(self):
-        for element in self._elements:
-            yield from element.get_variables()
-
-class TOK_BINOP_ADD(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_ADD"
-    _c_token = "+"
-
-class TOK_BINOP_SUB(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_SUB"
-    _c_token = "-"
-
-class TOK_BINOP_MULT(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_MULT"
-    _c_token = "*"
-
-class TOK_BINOP_AND(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_AND"
-    _c_token = "&"
-
-class TOK_BINOP_OR(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_OR"
-    _c_token = "|"
-
-class TOK_BINOP_XOR(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_XOR"
-    _c_token = "^"
-
-class TOK_BINOP_LSHIFT(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_LSHIFT"
-    _c_token = "<<"
-
-class TOK_BINOP_RSHIFT(TOK_BINARY_OPERATION):
-    _name = "TOK_BINOP_RSHIFT"
-    _c_token = ">>"
+        return self._vars
+
+class TOK_BINOP(TOK_BINARY_OPERATION):
+    """
+    The single concrete binary-operation class. The operator is carried as an
+    instance attribute instead of one trivial subclass per operator, so there
+    is no per-operator class to walk in the MRO on every to_c call.
+    """
+    __slots__ = ("_name", "_c_token")
+
+    _NAMES = {
+        "+": "TOK_BINOP_ADD",
+        "-": "TOK_BINOP_SUB",
+        "*": "TOK_BINOP_MULT",
+        "&": "TOK_BINOP_AND",
+        "|": "TOK_BINOP_OR",
+        "^": "TOK_BINOP_XOR",
+        "<<": "TOK_BINOP_LSHIFT",
+        ">>": "TOK_BINOP_RSHIFT",
+    }
+
+    def __init__(self, c_token: str, left: Token, right: Token):
+        super().__init__(left, right)
+        self._c_token = c_token
+        self._name = TOK_BINOP._NAMES[c_token]
+
+def _make_binop(c_token: str):
+    """
+    Returns a factory that builds a TOK_BINOP for the given operator and
+    immediately constant-folds it, so literal arithmetic never survives into
+    the AST. The factories keep the old TOK_BINOP_* names, so call sites (the
+    operator tables in both parsers) are unaffected by the collapse into one
+    class.
+    """
+    def binop(left: Token, right: Token) -> Token:
+        return TOK_BINOP(c_token, left, right).fold()
+
+    return binop
+
+TOK_BINOP_ADD = _make_binop("+")
+TOK_BINOP_SUB = _make_binop("-")
+TOK_BINOP_MULT = _make_binop("*")
+TOK_BINOP_AND = _make_binop("&")
+TOK_BINOP_OR = _make_binop("|")
+TOK_BINOP_XOR = _make_binop("^")
+TOK_BINOP_LSHIFT = _make_binop("<<")
+TOK_BINOP_RSHIFT = _make_binop(">>")